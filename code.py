@@ -1,22 +1,34 @@
 # spyfall_bot.py
 import asyncio
+import json
+import os
 import random
+import signal
+import struct
+import sys
 import time
 import logging
-from typing import Dict, Any
+from collections import deque
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Dict, Any, Set, List, Optional
 
 from telegram import (
+    ChatMember,
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
-from telegram.error import Forbidden
+from telegram.error import Forbidden, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
+    TypeHandler,
 )
+from telegram.request import BaseRequest
 
 # ----------------- Настройки -----------------
 TOKEN = "123"  # <- Вставь сюда свой токен
@@ -26,6 +38,38 @@ GAME_MAX_SECONDS = 15 * 60
 VOTE_TIMEOUT_SECONDS = 60
 SPY_GUESS_TIMEOUT = 30
 
+# Трансляция для зрителей
+BROADCAST_WORKERS = 8
+# Лимит Telegram ~30 сообщений/с на бота, и сами игры шлют через тот же лимит без ограничителя —
+# поэтому рассылке отдаём только часть, оставляя запас под сообщения игр
+BROADCAST_RATE = 20            # сообщений в секунду на всех зрителей
+BROADCAST_SEND_TIMEOUT = 10    # секунд на одну отправку зрителю
+BROADCAST_MAX_STRIKES = 3      # столько сбоев (ошибок или flood wait) подряд — и зритель отключается
+BROADCAST_FLOOD_WINDOW = 1.0   # если за это время flood wait пришёл сразу от нескольких чатов,
+BROADCAST_FLOOD_CHATS = 3      # это общий лимит бота, а не лимит одного чата — притормаживаем всех
+# Максимум зрителей у одной игры: столько, сколько рассылка успевает обойти за SPECTATOR_MAX_LAG секунд.
+# Зритель получает самое свежее событие игры, а не все подряд, так что больше отставать он не будет
+SPECTATOR_MAX_LAG = 60
+SPECTATORS_PER_GAME = BROADCAST_RATE * SPECTATOR_MAX_LAG
+SPECTATE_PER_CHAT = 3          # за сколькими играми сразу может следить один чат
+
+# Журнал событий (входящие апдейты и срабатывания таймеров) для воспроизведения
+EVENT_LOG_PATH = "spyfall_events.log"
+EVENT_LOG_MAX_BYTES = 10 * 1024 * 1024
+EVENT_LOG_BACKUPS = 5
+
+# Плавный перезапуск: бот перестаёт принимать /spyfall и передаёт состояние следующему процессу через файл.
+# SIGTERM — передать сразу (успевает за стоп-таймаут docker stop в 10 с и systemd в 90 с);
+# SIGUSR1 — сначала дать играм доиграть до DRAIN_SECONDS: стоп-таймаут супервизора должен быть больше
+HANDOVER_SIGNAL = "SIGTERM"
+DRAIN_SIGNAL = "SIGUSR1"
+DRAIN_SECONDS = 120
+HANDOVER_PATH = "spyfall_handover.json"
+HANDOVER_WAIT_SECONDS = DRAIN_SECONDS + 30   # сколько преемник ждёт файл передачи
+# Снапшот старше этого — от обычной остановки, а не от перезапуска: его игры давно неактуальны
+HANDOVER_MAX_AGE = HANDOVER_WAIT_SECONDS
+HANDOVER_FIRING_TIMEOUT = 5                  # сколько ждать уже сработавшие таймеры перед снапшотом
+
 # 20 локаций (как просил)
 LOCATIONS = [
     "Аэропорт", "Кафе", "Пляж", "Театр", "Стадион", "Космическая станция",
@@ -47,6 +91,51 @@ games: Dict[int, Dict[str, Any]] = {}
 # Активные голосования: chat_id -> vote_state
 active_votes: Dict[int, Dict[str, Any]] = {}
 
+# Зрители: chat_id игры -> {chat_id зрителей (чаты и каналы)}
+spectators: Dict[int, Set[int]] = {}
+
+# Очереди зрителей: chat_id зрителя -> {queue, strikes, games}
+subscribers: Dict[int, Dict[str, Any]] = {}
+
+# Пул рассылки: очередь готовых к отправке зрителей, воркеры, ограничитель скорости и счётчики
+broadcast: Dict[str, Any] = {
+    "ready": None,          # asyncio.Queue с chat_id зрителей, у которых есть неотправленные события
+    "scheduled": set(),     # зрители, уже стоящие в ready (чтобы не дублировать)
+    "workers": [],
+    "rate": BROADCAST_RATE,
+    "next_slot": 0.0,       # время (monotonic), раньше которого следующую отправку делать нельзя
+    "flood_waits": deque(maxlen=BROADCAST_FLOOD_CHATS * 4),   # недавние RetryAfter: (monotonic, chat_id)
+    "delivered": 0,
+    "lagged": 0,            # событий заменено более свежими, пока зритель ждал своей очереди
+    "dropped": 0,           # зрителей отключено
+}
+
+# Источник сидов раздачи: у каждой игры свой сид, он пишется в журнал, чтобы replay раздал те же роли
+rng = random.Random()
+
+# Открытый журнал событий: файл и его текущий размер
+event_log: Dict[str, Any] = {"file": None, "path": EVENT_LOG_PATH, "bytes": 0}
+
+# Режим воспроизведения: виртуальное время и таймеры, ждущие своей записи в журнале
+replay: Dict[str, Any] = {
+    "active": False,
+    "now": 0.0,
+    "timers": {},           # (имя таймера, chat_id) -> {fired: asyncio.Event, task}
+    "deals": {},            # chat_id -> deque сидов раздачи из журнала, по порядку игр
+}
+
+# Drain и передача состояния преемнику
+drain: Dict[str, Any] = {
+    "active": False,
+    "deadline": 0.0,
+    "task": None,
+    "handover": False,      # записать снапшот после остановки приложения
+    "last_update_id": 0,    # последний принятый апдейт
+    "resume_after": 0,      # апдейты с update_id <= этого уже обработал предыдущий процесс
+    "firing": set(),        # задачи таймеров, которые уже сработали и сейчас выполняют своё действие
+    "frozen": False,        # идёт запись снапшота: новые срабатывания таймеров достаются преемнику
+}
+
 
 # ----------------- Утилиты -----------------
 async def safe_send_pm(context: ContextTypes.DEFAULT_TYPE, user_id: int, text: str):
@@ -65,6 +154,328 @@ def format_players_list(players: Dict[int, Any]):
     return ", ".join(p["name"] for p in players.values())
 
 
+def clock() -> float:
+    """Текущее время; при воспроизведении — время из журнала."""
+    return replay["now"] if replay["active"] else time.time()
+
+
+# ----------------- ЖУРНАЛ СОБЫТИЙ -----------------
+# Формат: записи подряд, каждая — 4 байта длины (big-endian) + компактный JSON.
+def open_event_log(path: str = EVENT_LOG_PATH):
+    event_log["path"] = path
+    event_log["file"] = open(path, "ab")
+    event_log["bytes"] = event_log["file"].tell()
+
+
+def close_event_log():
+    if event_log["file"] is not None:
+        event_log["file"].close()
+        event_log["file"] = None
+
+
+def rotate_event_log():
+    """Ротация как у RotatingFileHandler: log -> log.1 -> log.2 ... (старейший удаляется).
+
+    Новый файл начинается с checkpoint — снапшота состояния, так что его можно воспроизводить
+    и без предыдущих (возможно, уже удалённых) файлов.
+    """
+    path = event_log["path"]
+    close_event_log()
+    for i in range(EVENT_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+    open_event_log(path)
+    record_event("checkpoint", snapshot=snapshot_state())
+
+
+def record_event(kind: str, **fields):
+    """Дописать событие в журнал (если он открыт)."""
+    f = event_log["file"]
+    if f is None:
+        return
+    payload = json.dumps({"t": clock(), "kind": kind, **fields}, ensure_ascii=False, separators=(",", ":")).encode()
+    # ротируем только перед апдейтом или таймером: в этот момент состояние целое и checkpoint ему соответствует
+    # (а, например, запись deal пишется посреди start_game_from_lobby)
+    if (kind in ("update", "timer") and event_log["bytes"]
+            and event_log["bytes"] + len(payload) + 4 > EVENT_LOG_MAX_BYTES):
+        rotate_event_log()
+        f = event_log["file"]
+    f.write(struct.pack(">I", len(payload)) + payload)
+    f.flush()
+    event_log["bytes"] += len(payload) + 4
+
+
+def read_event_log(path: str):
+    """Прочитать записи журнала по порядку; недописанная последняя запись пропускается."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            (size,) = struct.unpack(">I", header)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            yield json.loads(payload)
+
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Записать каждый входящий апдейт до того, как его обработают остальные хендлеры."""
+    record_event("update", update=update.to_dict())
+
+
+def deal_seed(chat_id: int) -> int:
+    """Сид раздачи ролей для новой игры: вживую — случайный (и в журнал), при replay — из журнала."""
+    if not replay["active"]:
+        seed = rng.randrange(2 ** 32)
+        record_event("deal", chat_id=chat_id, seed=seed)
+        return seed
+    seeds = replay["deals"].get(chat_id)
+    if not seeds:
+        logger.warning("Replay: в журнале нет сида раздачи для чата %s — роли не совпадут.", chat_id)
+        return rng.randrange(2 ** 32)
+    return seeds.popleft()
+
+
+async def wait_timer(name: str, chat_id: int, seconds: float):
+    """Подождать таймер и записать его срабатывание в журнал.
+
+    При воспроизведении таймер не спит, а ждёт, пока replay дойдёт до записи о его срабатывании.
+    """
+    if not replay["active"]:
+        await asyncio.sleep(seconds)
+        if drain["frozen"]:
+            # дедлайн уже в снапшоте — таймер сработает у преемника, а здесь ждёт отмены в cancel_timers
+            await asyncio.get_running_loop().create_future()
+        record_event("timer", timer=name, chat_id=chat_id)
+        task = asyncio.current_task()
+        drain["firing"].add(task)
+        task.add_done_callback(drain["firing"].discard)
+        return
+
+    key = (name, chat_id)
+    fired = asyncio.Event()
+    replay["timers"][key] = {"fired": fired, "task": asyncio.current_task()}
+    try:
+        await fired.wait()
+    finally:
+        if replay["timers"].get(key, {}).get("fired") is fired:
+            del replay["timers"][key]
+
+
+# ----------------- ТРАНСЛЯЦИЯ ДЛЯ ЗРИТЕЛЕЙ -----------------
+def subscribe(game_chat_id: int, sub_id: int):
+    """Подписать чат/канал sub_id на события игры в game_chat_id."""
+    sub = subscribers.get(sub_id)
+    if sub is None:
+        sub = subscribers[sub_id] = {
+            "queue": deque(),   # (chat_id игры, текст, итог ли это игры)
+            "strikes": 0,
+            "games": set(),
+        }
+    sub["games"].add(game_chat_id)
+    spectators.setdefault(game_chat_id, set()).add(sub_id)
+
+
+def unsubscribe(game_chat_id: int, sub_id: int):
+    """Отписать sub_id от игры; если подписок не осталось — убрать зрителя, когда его очередь опустеет."""
+    subs = spectators.get(game_chat_id)
+    if subs is not None:
+        subs.discard(sub_id)
+        if not subs:
+            del spectators[game_chat_id]
+    sub = subscribers.get(sub_id)
+    if sub is not None:
+        sub["games"].discard(game_chat_id)
+        forget_idle_subscriber(sub_id)
+
+
+def forget_idle_subscriber(sub_id: int):
+    """Убрать зрителя без подписок и событий — но не пока им занят воркер (он в scheduled)."""
+    sub = subscribers.get(sub_id)
+    if sub and not sub["games"] and not sub["queue"] and sub_id not in broadcast["scheduled"]:
+        del subscribers[sub_id]
+
+
+def end_spectating(game_chat_id: int):
+    """Игра (или несостоявшееся лобби) закончилась — подписки на неё снимаются.
+
+    Уже поставленные в очередь события (например, итог игры) зрители всё равно получат.
+    """
+    for sub_id in list(spectators.get(game_chat_id, ())):
+        unsubscribe(game_chat_id, sub_id)
+
+
+def drop_subscriber(sub_id: int, reason: str):
+    """Отключить зрителя от всех игр (бот выгнан, чат не отвечает и т.п.)."""
+    sub = subscribers.get(sub_id)
+    if sub is None:
+        return
+    for game_chat_id in list(sub["games"]):
+        unsubscribe(game_chat_id, sub_id)
+    subscribers.pop(sub_id, None)
+    broadcast["dropped"] += 1
+    logger.info("Spectator %s dropped: %s", sub_id, reason)
+
+
+def publish_event(chat_id: int, text: str, final: bool = False):
+    """Разослать событие игры зрителям.
+
+    Текст собирается один раз и кладётся в очереди зрителей без ожидания —
+    отправкой занимаются воркеры, так что сама игра не тормозит. Не отправленное ещё событие
+    той же игры заменяется новым: отстающий зритель перескакивает к свежему ходу.
+    Итог игры (final=True) не заменяется никогда.
+    """
+    subs = spectators.get(chat_id)
+    ready = broadcast["ready"]
+    if not subs or ready is None:
+        return
+
+    item = (chat_id, f"👁 Игра {chat_id}: {text}", final)
+    for sub_id in subs:
+        sub = subscribers.get(sub_id)
+        if sub is None:
+            continue
+        queue = sub["queue"]
+        # в очереди не больше одного обычного события на игру, а игр у зрителя — SPECTATE_PER_CHAT
+        for i, (game_chat_id, _, pending_final) in enumerate(queue):
+            if game_chat_id == chat_id and not pending_final:
+                queue[i] = item
+                broadcast["lagged"] += 1
+                break
+        else:
+            queue.append(item)
+        if sub_id not in broadcast["scheduled"]:
+            broadcast["scheduled"].add(sub_id)
+            ready.put_nowait(sub_id)
+
+
+async def broadcast_throttle():
+    """Общий ограничитель скорости: каждый воркер занимает себе слот и ждёт его."""
+    rate = broadcast["rate"]
+    if rate <= 0:
+        return
+    now = time.monotonic()
+    slot = max(now, broadcast["next_slot"])
+    broadcast["next_slot"] = slot + 1 / rate
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+def add_strike(sub_id: int, sub: Dict[str, Any], reason: str) -> bool:
+    """Засчитать зрителю сбой; вернуть True, если он отключён."""
+    sub["strikes"] += 1
+    logger.warning("Сбой рассылки зрителю %s (%s/%s): %s", sub_id, sub["strikes"], BROADCAST_MAX_STRIKES, reason)
+    if sub["strikes"] >= BROADCAST_MAX_STRIKES:
+        drop_subscriber(sub_id, "слишком много сбоев отправки")
+        return True
+    return False
+
+
+def note_flood_wait(sub_id: int, delay: float):
+    """Запомнить RetryAfter; если он пришёл от нескольких чатов сразу — это лимит бота, тормозим всех."""
+    now = time.monotonic()
+    hits = broadcast["flood_waits"]
+    hits.append((now, sub_id))
+    recent = {chat_id for at, chat_id in hits if now - at <= BROADCAST_FLOOD_WINDOW}
+    if len(recent) >= BROADCAST_FLOOD_CHATS:
+        broadcast["next_slot"] = max(broadcast["next_slot"], now + delay)
+
+
+async def deliver_one(bot, sub_id: int) -> Optional[float]:
+    """Отправить зрителю одно событие из его очереди.
+
+    Вернуть None, если зрителя больше не нужно ставить в очередь, иначе через сколько секунд
+    поставить его снова (0 — сразу, больше 0 — после flood wait этого чата).
+    """
+    sub = subscribers.get(sub_id)
+    if not sub or not sub["queue"]:
+        return None
+
+    item = sub["queue"].popleft()
+    text = item[1]
+    await broadcast_throttle()
+    try:
+        await asyncio.wait_for(bot.send_message(sub_id, text), BROADCAST_SEND_TIMEOUT)
+    except Forbidden:
+        drop_subscriber(sub_id, "бот не может писать в чат")
+        return None
+    except RetryAfter as e:
+        if subscribers.get(sub_id) is not sub:
+            return requeue_delay(sub_id)
+        # обычно это лимит одного чата (~20 сообщений/мин в группе): ждёт только этот зритель
+        delay = e.retry_after
+        if isinstance(delay, timedelta):
+            delay = delay.total_seconds()
+        if add_strike(sub_id, sub, f"flood wait {delay} с"):
+            return None
+        sub["queue"].appendleft(item)
+        note_flood_wait(sub_id, delay)
+        return delay
+    except Exception as e:
+        if subscribers.get(sub_id) is not sub:
+            return requeue_delay(sub_id)
+        if add_strike(sub_id, sub, str(e)):
+            return None
+        return requeue_delay(sub_id)
+
+    broadcast["delivered"] += 1
+    if subscribers.get(sub_id) is sub:
+        sub["strikes"] = 0
+    return requeue_delay(sub_id)
+
+
+def requeue_delay(sub_id: int) -> Optional[float]:
+    """После отправки: ставить ли зрителя снова в очередь.
+
+    Смотрим на текущую запись, а не на ту, что была до await: за время отправки зрителя могли
+    отписать и подписать заново — тогда это уже другой объект со своей очередью.
+    """
+    sub = subscribers.get(sub_id)
+    return 0.0 if sub and sub["queue"] else None
+
+
+async def broadcast_worker(bot):
+    """Воркер рассылки: берёт зрителя, отправляет ему одно событие и ставит в конец очереди (round-robin)."""
+    ready = broadcast["ready"]
+    loop = asyncio.get_running_loop()
+    while True:
+        sub_id = await ready.get()
+        try:
+            delay = await deliver_one(bot, sub_id)
+            if delay is None:
+                broadcast["scheduled"].discard(sub_id)
+                forget_idle_subscriber(sub_id)
+            elif delay > 0:
+                # зритель остаётся в scheduled и вернётся в очередь, когда истечёт его flood wait
+                loop.call_later(delay, ready.put_nowait, sub_id)
+            else:
+                ready.put_nowait(sub_id)
+        except Exception as e:
+            broadcast["scheduled"].discard(sub_id)
+            forget_idle_subscriber(sub_id)
+            logger.exception("Ошибка воркера рассылки: %s", e)
+        finally:
+            ready.task_done()
+
+
+def start_broadcast_workers(bot, workers: int = BROADCAST_WORKERS, rate: float = BROADCAST_RATE):
+    """Запустить пул воркеров рассылки (вызывается внутри работающего event loop)."""
+    broadcast["ready"] = asyncio.Queue()
+    broadcast["scheduled"].clear()
+    broadcast["rate"] = rate
+    broadcast["next_slot"] = 0.0
+    broadcast["workers"] = [asyncio.create_task(broadcast_worker(bot)) for _ in range(workers)]
+
+
+def stop_broadcast_workers():
+    for task in broadcast["workers"]:
+        task.cancel()
+    broadcast["workers"] = []
+    broadcast["ready"] = None
+
+
 # ----------------- ЛОББИ -----------------
 async def cmd_spyfall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Создать лобби — старт набора на 60 секунд."""
@@ -79,6 +490,9 @@ async def cmd_spyfall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat_id in lobbies:
         await update.message.reply_text("Набор уже запущен в этом чате.")
         return
+    if drain["active"]:
+        await update.message.reply_text("🔧 Бот перезапускается — новую игру можно будет начать через пару минут.")
+        return
 
     # Проверка: может ли бот писать в ЛС тому, кто запустил?
     try:
@@ -100,6 +514,7 @@ async def cmd_spyfall(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "players": {},           # user_id -> {"name": str, "username": str}
         "created_by": user.id,
         "started": False,
+        "deadline": clock() + LOBBY_SECONDS,
         "task": asyncio.create_task(lobby_countdown(chat_id, context)),
     }
 
@@ -111,9 +526,9 @@ async def cmd_spyfall(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def lobby_countdown(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def lobby_countdown(chat_id: int, context: ContextTypes.DEFAULT_TYPE, seconds: float = LOBBY_SECONDS):
     """Таймер лобби — через LOBBY_SECONDS запускаем игру если хватает игроков."""
-    await asyncio.sleep(LOBBY_SECONDS)
+    await wait_timer("lobby_countdown", chat_id, seconds)
     lobby = lobbies.get(chat_id)
     if not lobby:
         return
@@ -129,6 +544,7 @@ async def lobby_countdown(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
                 logger.info("User %s didn't open PM, cannot notify about cancelled game.", uid)
         # удаляем лобби (без сообщений в общий чат по требованию)
         del lobbies[chat_id]
+        end_spectating(chat_id)
         logger.info("Lobby %s cancelled (not enough players).", chat_id)
         return
 
@@ -188,16 +604,18 @@ async def start_game_from_lobby(chat_id: int, context: ContextTypes.DEFAULT_TYPE
             except Forbidden:
                 pass
         del lobbies[chat_id]
+        end_spectating(chat_id)
         return
 
     # формируем игровое состояние
     player_ids = list(players.keys())
-    location = random.choice(LOCATIONS)
-    spy_id = random.choice(player_ids)
+    deal = random.Random(deal_seed(chat_id))
+    location = deal.choice(LOCATIONS)
+    spy_id = deal.choice(player_ids)
     order = player_ids.copy()
-    random.shuffle(order)
+    deal.shuffle(order)
     # выбран, кто стартует
-    current_index = random.randrange(len(order))
+    current_index = deal.randrange(len(order))
 
     game = {
         "players": players,             # user_id -> {"name", "username"}
@@ -206,7 +624,7 @@ async def start_game_from_lobby(chat_id: int, context: ContextTypes.DEFAULT_TYPE
         "order": order,                 # очередь потенциальных спрашивающих
         "current_index": current_index,
         "started": True,
-        "started_at": time.time(),
+        "started_at": clock(),
         "mistakes": 0,                  # неверные обвинения жителей
         "active_vote": None,            # структура голосования (если есть)
         "lobby_task": lobbies[chat_id]["task"],
@@ -301,6 +719,7 @@ async def send_turn_keyboard(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     )
     # сохраняем id последнего сообщения с кнопками, чтобы иметь возможность редактировать/пометить
     game["last_ask_message_id"] = msg.message_id
+    publish_event(chat_id, f"➡️ Ход: <b>{current_name}</b>.")
 
 
 # Обработка callback'ов (ask, pass, vote_yes и т.д.)
@@ -436,6 +855,7 @@ async def cmd_vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "initiator": user.id,
         "votes": set(),   # user_ids, голосующие "за"
         "message_id": None,
+        "deadline": clock() + VOTE_TIMEOUT_SECONDS,
         "end_task": None,
     }
     active_votes[chat_id] = vote
@@ -495,10 +915,10 @@ async def handle_vote_yes(query, context, chat_id: int, target_id: int):
         await query.answer(f"Голос учтён ({count}/{total}).")
 
 
-async def vote_timeout(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def vote_timeout(chat_id: int, context: ContextTypes.DEFAULT_TYPE, seconds: float = VOTE_TIMEOUT_SECONDS):
     """Если голосование не завершилось за VOTE_TIMEOUT_SECONDS — просто завершаем с ничьей."""
     try:
-        await asyncio.sleep(VOTE_TIMEOUT_SECONDS)
+        await wait_timer("vote_timeout", chat_id, seconds)
         gv = active_votes.get(chat_id)
         game = games.get(chat_id)
         if not gv or not game:
@@ -528,15 +948,18 @@ async def finalize_vote(chat_id: int, context: ContextTypes.DEFAULT_TYPE, target
     if target_id == spy_id:
         # жители вычислили шпиона — шпион получает шанс угадать локацию
         game["spy_exposed"] = True
+        publish_event(chat_id, f"🔔 Жители вычислили шпиона: <b>{target_name}</b>. Шпион пытается угадать локацию.")
         await context.bot.send_message(chat_id, f"🔔 Жители вычислили шпиона: <b>{target_name}</b>.\n"
                                                 "Шпиону даётся шанс угадать локацию. Шпион, используй команду:\n"
                                                 "/guess <название локации>\n"
                                                 f"У тебя {SPY_GUESS_TIMEOUT} секунд.")
         # стартуем таймер на угадывание шпиона
+        game["spy_guess_deadline"] = clock() + SPY_GUESS_TIMEOUT
         game["spy_guess_task"] = asyncio.create_task(spy_guess_timeout(chat_id, context))
     else:
         # ошибочное обвинение
         game["mistakes"] += 1
+        publish_event(chat_id, f"❌ <b>{target_name}</b> — не шпион. Ошибок у жителей: {game['mistakes']}/2.")
         await context.bot.send_message(chat_id, f"❌ Это был не шпион. Ошибок у жителей: {game['mistakes']}/2.")
         if game["mistakes"] >= 2:
             # шпион побеждает
@@ -600,10 +1023,10 @@ async def cmd_guess(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await end_game(user_game_chat, context, winner="residents", reason="Шпион ошибся при угадывании.")
 
 
-async def spy_guess_timeout(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def spy_guess_timeout(chat_id: int, context: ContextTypes.DEFAULT_TYPE, seconds: float = SPY_GUESS_TIMEOUT):
     """Шпиону дали время на угадывание после разоблачения; если таймаут — жители выигрывают."""
     try:
-        await asyncio.sleep(SPY_GUESS_TIMEOUT)
+        await wait_timer("spy_guess_timeout", chat_id, seconds)
         game = games.get(chat_id)
         if not game:
             return
@@ -615,10 +1038,10 @@ async def spy_guess_timeout(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ----------------- ТАЙМЕР И ЗАВЕРШЕНИЕ -----------------
-async def game_timer(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def game_timer(chat_id: int, context: ContextTypes.DEFAULT_TYPE, seconds: float = GAME_MAX_SECONDS):
     """Таймер максимальной продолжительности игры (15 минут)."""
     try:
-        await asyncio.sleep(GAME_MAX_SECONDS)
+        await wait_timer("game_timer", chat_id, seconds)
         game = games.get(chat_id)
         if not game or not game.get("started"):
             return
@@ -646,6 +1069,8 @@ async def end_game(chat_id: int, context: ContextTypes.DEFAULT_TYPE, winner: str
     result_text += f"\n\nЛокация: <b>{location}</b>."
 
     await context.bot.send_message(chat_id, result_text)
+    publish_event(chat_id, result_text, final=True)
+    end_spectating(chat_id)
 
     # отменяем задачи
     try:
@@ -691,9 +1116,498 @@ async def cmd_leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Ты не в лобби или оно уже стартовало.")
 
 
+async def is_chat_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, admin: bool = False):
+    """Проверить, что пользователь состоит в чате (или является его админом, если admin=True)."""
+    try:
+        member = await context.bot.get_chat_member(chat_id, user_id)
+    except TelegramError:
+        return False
+    if admin:
+        return member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+    return member.status not in (ChatMember.LEFT, ChatMember.BANNED)
+
+
+async def spectator_target(update: Update, context: ContextTypes.DEFAULT_TYPE, arg_index: int):
+    """Чат, куда транслировать: текущий или (например, канал) из аргумента — тогда нужны права админа в нём."""
+    chat_id = update.effective_chat.id
+    if len(context.args) <= arg_index:
+        return chat_id
+    try:
+        target_id = int(context.args[arg_index])
+    except ValueError:
+        await update.message.reply_text("Неверный chat_id канала.")
+        return None
+    if target_id != chat_id and not await is_chat_member(context, target_id, update.effective_user.id, admin=True):
+        await update.message.reply_text("Транслировать в другой чат или канал может только его администратор.")
+        return None
+    return target_id
+
+
+async def cmd_spectate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/spectate <chat_id игры> [chat_id канала] — транслировать ход игры из другого чата сюда (или в канал)."""
+    message = update.message
+    user = update.effective_user
+    try:
+        game_chat_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await message.reply_text("Использование: /spectate <chat_id чата с игрой> [chat_id канала]")
+        return
+
+    if game_chat_id not in games and game_chat_id not in lobbies:
+        await message.reply_text("В этом чате сейчас нет ни игры, ни набора игроков.")
+        return
+    # следить за игрой может только тот, кто сам состоит в чате с игрой — иначе чужие группы видно снаружи
+    if not await is_chat_member(context, game_chat_id, user.id):
+        await message.reply_text("Следить можно только за игрой в чате, где ты состоишь.")
+        return
+
+    sub_id = await spectator_target(update, context, 1)
+    if sub_id is None:
+        return
+    sub = subscribers.get(sub_id)
+    if sub and game_chat_id not in sub["games"] and len(sub["games"]) >= SPECTATE_PER_CHAT:
+        await message.reply_text(f"Один чат может следить максимум за {SPECTATE_PER_CHAT} играми.")
+        return
+    if len(spectators.get(game_chat_id, ())) >= SPECTATORS_PER_GAME:
+        await message.reply_text("У этой игры уже максимум зрителей.")
+        return
+
+    subscribe(game_chat_id, sub_id)
+    unspectate_args = f"{game_chat_id}" if sub_id == update.effective_chat.id else f"{game_chat_id} {sub_id}"
+    await message.reply_text(
+        f"👁 Чат {sub_id} теперь следит за игрой в чате {game_chat_id} до её конца. "
+        f"Отписаться: /unspectate {unspectate_args}"
+    )
+
+
+async def cmd_unspectate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/unspectate [chat_id игры] [chat_id канала] — перестать следить за игрой (без аргументов — за всеми)."""
+    message = update.message
+    sub_id = await spectator_target(update, context, 1)
+    if sub_id is None:
+        return
+    sub = subscribers.get(sub_id)
+    if not sub or not sub["games"]:
+        await message.reply_text("Этот чат ни за чем не следит.")
+        return
+
+    if context.args:
+        try:
+            game_chat_ids = [int(context.args[0])]
+        except ValueError:
+            await message.reply_text("Использование: /unspectate [chat_id чата с игрой] [chat_id канала]")
+            return
+    else:
+        game_chat_ids = list(sub["games"])
+
+    for game_chat_id in game_chat_ids:
+        unsubscribe(game_chat_id, sub_id)
+    await message.reply_text("Трансляция остановлена.")
+
+
+# ----------------- Бенчмарк трансляции -----------------
+async def bench_broadcast(subscriber_count: int = 10000, events: int = 30, interval: float = 10.0,
+                          speedup: float = 100.0):
+    """Замер рассылки при настоящем BROADCAST_RATE: subscriber_count зрителей, событие раз в interval секунд.
+
+    Последнее событие — итог игры. После него ждём, сколько нужно на полный обход всех зрителей.
+    Время ускорено в speedup раз (и лимит скорости, и интервалы), бот фейковый — так 10k зрителей
+    укладываются в несколько секунд. Задержки печатаются в «игровых» секундах.
+    """
+    tail = subscriber_count / BROADCAST_RATE + interval
+    sent_at: Dict[str, int] = {}
+    latencies: List[List[float]] = [[] for _ in range(events)]
+    published_at: List[float] = []
+
+    async def fake_send_message(chat_id, text, **kwargs):
+        i = sent_at[text]
+        latencies[i].append((time.perf_counter() - published_at[i]) * speedup)
+
+    broadcast["delivered"] = broadcast["lagged"] = 0
+    start_broadcast_workers(SimpleNamespace(send_message=fake_send_message), rate=BROADCAST_RATE * speedup)
+    game_chat_id = -1
+    for sub_id in range(1, subscriber_count + 1):
+        subscribe(game_chat_id, sub_id)
+
+    started = time.perf_counter()
+    publish_cost = 0.0
+    for i in range(events):
+        text = f"Событие {i}"
+        sent_at[f"👁 Игра {game_chat_id}: {text}"] = i
+        published_at.append(time.perf_counter())
+        publish_event(game_chat_id, text, final=i == events - 1)
+        publish_cost += time.perf_counter() - published_at[-1]
+        await asyncio.sleep(interval / speedup)
+    await asyncio.sleep(max(0.0, started + ((events - 1) * interval + tail) / speedup - time.perf_counter()))
+    stop_broadcast_workers()
+
+    print(f"Зрителей: {subscriber_count}, событий: {events} (раз в {interval:g} с), "
+          f"лимит: {BROADCAST_RATE} сообщений/с (лимит зрителей на игру: {SPECTATORS_PER_GAME})")
+    print(f"publish_event: {publish_cost * 1000 / events:.2f} мс на событие (время, отнятое у игры)")
+    print("Событие  доставлено      p50, с     max, с")
+    for i, values in enumerate(latencies):
+        values.sort()
+        p50 = f"{values[len(values) // 2]:10.1f}" if values else f"{'—':>10}"
+        worst = f"{values[-1]:10.1f}" if values else f"{'—':>10}"
+        print(f"{i:7d}  {len(values):5d}/{subscriber_count:<5d} {p50} {worst}")
+    queued = sum(len(sub["queue"]) for sub in subscribers.values())
+    print(f"Доставлено: {broadcast['delivered']}, заменено более свежими (lagged): {broadcast['lagged']}, "
+          f"не доставлено к {(events - 1) * interval + tail:g} с: {queued}")
+    print(f"Итог игры получили {len(latencies[-1])}/{subscriber_count}; "
+          f"полный обход зрителей занимает ~{subscriber_count / BROADCAST_RATE:.0f} с — "
+          f"настолько отстаёт самый медленный зритель")
+
+
+# ----------------- DRAIN И ПЕРЕДАЧА СОСТОЯНИЯ -----------------
+async def track_update_offset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запомнить update_id и отбросить апдейты, которые уже обработал предыдущий процесс."""
+    if update.update_id <= drain["resume_after"]:
+        raise ApplicationHandlerStop
+    drain["last_update_id"] = max(drain["last_update_id"], update.update_id)
+
+
+def start_drain(app: Application, seconds: float = DRAIN_SECONDS):
+    """Сигнал на перезапуск: перестать принимать /spyfall и дать играм доиграть не дольше seconds.
+
+    seconds=0 (SIGTERM) — передать состояние сразу, в том числе посреди уже идущего drain.
+    """
+    deadline = clock() + seconds
+    if drain["active"]:
+        if deadline < drain["deadline"]:
+            logger.info("Drain: передаём состояние через %s с.", seconds)
+            drain["deadline"] = deadline
+        return
+    drain["active"] = True
+    drain["deadline"] = deadline
+    drain["task"] = asyncio.create_task(drain_and_stop(app))
+    logger.info("Drain: новые игры не принимаются, ждём завершения %s игр и %s лобби.", len(games), len(lobbies))
+
+
+async def drain_and_stop(app: Application):
+    while (games or lobbies) and clock() < drain["deadline"]:
+        await asyncio.sleep(1)
+    # снапшот пишется в on_stop — когда поллинг остановлен и все полученные апдейты обработаны
+    drain["handover"] = True
+    app.stop_running()
+
+
+def remaining(deadline: float) -> float:
+    return max(0.0, deadline - clock())
+
+
+def snapshot_state() -> Dict[str, Any]:
+    """Собрать всё, что нужно преемнику: лобби, игры, голосования, зрителей, дедлайны таймеров и offset."""
+    return {
+        "saved_at": clock(),
+        "last_update_id": drain["last_update_id"],
+        "lobbies": {
+            chat_id: {"players": lobby["players"], "created_by": lobby["created_by"], "deadline": lobby["deadline"]}
+            for chat_id, lobby in lobbies.items()
+        },
+        "games": {
+            chat_id: {k: v for k, v in game.items() if not k.endswith("_task")}
+            for chat_id, game in games.items()
+        },
+        "active_votes": {
+            chat_id: {
+                "target": vote["target"],
+                "initiator": vote["initiator"],
+                "votes": list(vote["votes"]),
+                "message_id": vote["message_id"],
+                "deadline": vote["deadline"],
+            }
+            for chat_id, vote in active_votes.items()
+        },
+        "spectators": {chat_id: list(subs) for chat_id, subs in spectators.items()},
+    }
+
+
+def write_handover(snapshot: Dict[str, Any], path: str = HANDOVER_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def cancel_timers():
+    """Остановить все таймеры, чтобы после снапшота они не сработали в уходящем процессе."""
+    tasks = [lobby["task"] for lobby in lobbies.values()]
+    tasks += [vote["end_task"] for vote in active_votes.values()]
+    for game in games.values():
+        # lobby_task может ещё раздавать роли в start_game_from_lobby
+        tasks += [game["lobby_task"], game["timer_task"], game["spy_guess_task"]]
+    for task in tasks:
+        if task and not task.done():
+            task.cancel()
+
+
+def players_from_json(players: Dict[str, Any]) -> Dict[int, Any]:
+    # JSON превращает ключи-user_id в строки
+    return {int(uid): p for uid, p in players.items()}
+
+
+def restore_handover(snapshot: Dict[str, Any], app: Application):
+    """Восстановить состояние из снапшота и перезапустить таймеры на оставшееся время."""
+    context = app.context_types.context(app)
+    drain["resume_after"] = drain["last_update_id"] = snapshot["last_update_id"]
+
+    for cid, lobby in snapshot["lobbies"].items():
+        chat_id = int(cid)
+        lobbies[chat_id] = {
+            "players": players_from_json(lobby["players"]),
+            "created_by": lobby["created_by"],
+            "started": False,
+            "deadline": lobby["deadline"],
+            "task": asyncio.create_task(lobby_countdown(chat_id, context, remaining(lobby["deadline"]))),
+        }
+
+    for cid, game in snapshot["games"].items():
+        chat_id = int(cid)
+        game["players"] = players_from_json(game["players"])
+        game["lobby_task"] = None
+        game["timer_task"] = asyncio.create_task(
+            game_timer(chat_id, context, remaining(game["started_at"] + GAME_MAX_SECONDS))
+        )
+        game["spy_guess_task"] = None
+        if game["spy_exposed"]:
+            game["spy_guess_task"] = asyncio.create_task(
+                spy_guess_timeout(chat_id, context, remaining(game["spy_guess_deadline"]))
+            )
+        games[chat_id] = game
+
+    for cid, vote in snapshot["active_votes"].items():
+        chat_id = int(cid)
+        vote["votes"] = set(vote["votes"])
+        vote["end_task"] = asyncio.create_task(vote_timeout(chat_id, context, remaining(vote["deadline"])))
+        active_votes[chat_id] = vote
+
+    for cid, subs in snapshot["spectators"].items():
+        for sub_id in subs:
+            subscribe(int(cid), sub_id)
+
+    logger.info("Восстановлено из снапшота: %s игр, %s лобби, %s голосований; продолжаем после update_id %s.",
+                len(games), len(lobbies), len(active_votes), drain["resume_after"])
+
+
+def wait_for_handover(path: str = HANDOVER_PATH, timeout: float = HANDOVER_WAIT_SECONDS):
+    """Преемник: дождаться, пока уходящий процесс запишет снапшот (до этого поллить нельзя — будет Conflict)."""
+    waited = 0.0
+    while not os.path.exists(path) and waited < timeout:
+        time.sleep(0.5)
+        waited += 0.5
+    if not os.path.exists(path):
+        logger.warning("Handover: файл %s так и не появился, стартуем с пустым состоянием.", path)
+
+
+# ----------------- Воспроизведение журнала -----------------
+class ReplayRequest(BaseRequest):
+    """Фейковый транспорт Bot API для replay: никуда не ходит, отвечает правдоподобными объектами."""
+
+    def __init__(self, bot_user: Dict[str, Any]):
+        self.bot_user = bot_user
+        self.message_id = 0
+        self.calls = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls += 1
+        if api_method == "getMe":
+            result = self.bot_user
+        elif api_method == "getChatMember":
+            # реальный ответ в журнал не пишется; при воспроизведении проверки прав считаем пройденными
+            result = {"status": "creator", "user": self.bot_user, "is_anonymous": False}
+        elif api_method == "sendMessage":
+            self.message_id += 1
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": self.message_id,
+                "date": int(clock()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def describe_event(rec: Dict[str, Any]) -> str:
+    if rec["kind"] == "timer":
+        return f"{rec['timer']} chat={rec['chat_id']}"
+    update = rec["update"]
+    if "callback_query" in update:
+        return f"callback {update['callback_query'].get('data')}"
+    message = update.get("message") or update.get("channel_post") or {}
+    return f"chat={message.get('chat', {}).get('id')} {message.get('text', '')}"
+
+
+async def fire_replay_timer(name: str, chat_id: int):
+    """Сработать таймер, ожидающий в replay, и дождаться, пока его задача доработает."""
+    key = (name, chat_id)
+    for _ in range(10):
+        pending = replay["timers"].get(key)
+        if pending:
+            break
+        await asyncio.sleep(0)
+    else:
+        logger.warning("Replay: таймер %s для чата %s не запущен — пропускаем.", name, chat_id)
+        return
+    pending["fired"].set()
+    await asyncio.wait([pending["task"]])
+
+
+async def reset_replay_state():
+    """Запись start — процесс перезапустился: память пуста, его таймеры больше не сработают."""
+    pending = [timer["task"] for timer in replay["timers"].values()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    replay["timers"].clear()
+    lobbies.clear()
+    games.clear()
+    active_votes.clear()
+    spectators.clear()
+    subscribers.clear()
+    drain["last_update_id"] = drain["resume_after"] = 0
+
+
+async def replay_event_log(paths: List[str]):
+    """Прогнать журнал(ы) через хендлеры бота с виртуальным временем и фейковым Bot API."""
+    records = []
+    for path in paths:
+        file_records = list(read_event_log(path))
+        if file_records and file_records[0]["kind"] not in ("start", "checkpoint", "resume"):
+            logger.warning("Replay: %s начинается не с start/checkpoint — игры, начатые раньше, "
+                           "не восстановятся, пока не встретится start или checkpoint.", path)
+        records += file_records
+    start = next((rec for rec in records if rec["kind"] == "start"), None)
+    bot_user = start["bot"] if start else {"id": 1, "is_bot": True, "first_name": "Spyfall", "username": "spyfall_bot"}
+    for rec in records:
+        if rec["kind"] == "deal":
+            replay["deals"].setdefault(rec["chat_id"], deque()).append(rec["seed"])
+
+    replay["active"] = True
+    request = ReplayRequest(bot_user)
+    app = Application.builder().token(TOKEN).request(request).get_updates_request(ReplayRequest(bot_user)).updater(None).build()
+    register_handlers(app)
+    await app.initialize()
+
+    timings: Dict[str, List[float]] = {}
+    for i, rec in enumerate(records):
+        if rec["kind"] == "start":
+            replay["now"] = rec["t"]
+            await reset_replay_state()
+            continue
+        if rec["kind"] in ("resume", "checkpoint"):
+            # снапшот — полное состояние (преемника или процесса на момент ротации): всё прежнее сбрасываем
+            replay["now"] = rec["t"]
+            await reset_replay_state()
+            restore_handover(rec["snapshot"], app)
+            continue
+        if rec["kind"] not in ("update", "timer"):
+            continue
+        replay["now"] = rec["t"]
+        started = time.perf_counter()
+        if rec["kind"] == "update":
+            await app.process_update(Update.de_json(rec["update"], app.bot))
+            # дать только что созданным задачам (таймерам) дойти до ожидания
+            await asyncio.sleep(0)
+        else:
+            await fire_replay_timer(rec["timer"], rec["chat_id"])
+        elapsed = (time.perf_counter() - started) * 1000
+        timings.setdefault(rec["kind"], []).append(elapsed)
+        print(f"{i:6d} {rec['kind']:6s} {elapsed:8.2f} мс  {describe_event(rec)}")
+
+    for pending in list(replay["timers"].values()):
+        pending["task"].cancel()
+    await app.shutdown()
+
+    print("\nВремя обработки:")
+    for kind, values in timings.items():
+        values.sort()
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"  {kind:6s} n={len(values)} сумма={sum(values):.1f} мс среднее={sum(values) / len(values):.2f} мс "
+              f"p95={p95:.2f} мс max={values[-1]:.2f} мс")
+    print(f"Вызовов Bot API: {request.calls}")
+
+    print("\nСостояние после воспроизведения:")
+    for chat_id, lobby in lobbies.items():
+        print(f"  лобби {chat_id}: {format_players_list(lobby['players'])}")
+    for chat_id, game in games.items():
+        current_id = game["order"][game["current_index"]]
+        print(f"  игра {chat_id}: локация={game['location']} шпион={game['players'][game['spy_id']]['name']} "
+              f"ход={game['players'][current_id]['name']} ошибок={game['mistakes']} "
+              f"шпион раскрыт={game['spy_exposed']} голосование={chat_id in active_votes}")
+    if not lobbies and not games:
+        print("  активных лобби и игр нет")
+
+
+async def on_startup(app: Application):
+    open_event_log()
+    record_event("start", bot=app.bot.bot.to_dict())
+    start_broadcast_workers(app.bot)
+
+    # принять состояние от предыдущего процесса, если он его оставил только что
+    if os.path.exists(HANDOVER_PATH):
+        with open(HANDOVER_PATH, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        os.remove(HANDOVER_PATH)
+        age = clock() - snapshot["saved_at"]
+        if age > HANDOVER_MAX_AGE:
+            logger.warning("Handover: снапшот %s записан %.0f с назад (больше %s с) — игры устарели, не восстанавливаем.",
+                           HANDOVER_PATH, age, HANDOVER_MAX_AGE)
+        else:
+            record_event("resume", snapshot=snapshot)
+            restore_handover(snapshot, app)
+
+    loop = asyncio.get_running_loop()
+    for name, seconds in ((HANDOVER_SIGNAL, 0), (DRAIN_SIGNAL, DRAIN_SECONDS)):
+        sig = getattr(signal, name, None)
+        if sig is None:
+            continue
+        try:
+            loop.add_signal_handler(sig, start_drain, app, seconds)
+        except NotImplementedError:
+            # Windows: сигналов нет, drain недоступен
+            logger.warning("Drain: не удалось повесить обработчик на %s.", name)
+
+
+async def on_stop(app: Application):
+    if drain["handover"]:
+        # сработавший таймер (например, старт игры посреди раздачи ролей) должен доработать до снапшота,
+        # иначе игра уйдёт преемнику недоделанной, а этот процесс продолжит её вести параллельно
+        drain["frozen"] = True
+        deadline = time.monotonic() + HANDOVER_FIRING_TIMEOUT
+        while drain["firing"] and time.monotonic() < deadline:
+            await asyncio.wait(list(drain["firing"]), timeout=deadline - time.monotonic(),
+                               return_when=asyncio.FIRST_COMPLETED)
+        write_handover(snapshot_state())
+        cancel_timers()
+        logger.info("Handover: состояние записано в %s (%s игр, %s лобби).", HANDOVER_PATH, len(games), len(lobbies))
+
+
+async def on_shutdown(app: Application):
+    stop_broadcast_workers()
+    close_event_log()
+
+
 # ----------------- Запуск бота -----------------
-def main():
-    app = Application.builder().token(TOKEN).build()
+def register_handlers(app: Application):
+    # offset и журнал событий — раньше всех остальных хендлеров
+    app.add_handler(TypeHandler(Update, track_update_offset), group=-2)
+    app.add_handler(TypeHandler(Update, record_update), group=-1)
 
     app.add_handler(CommandHandler("spyfall", cmd_spyfall))
     app.add_handler(CommandHandler("join", cmd_join))
@@ -701,12 +1615,36 @@ def main():
     app.add_handler(CommandHandler("guess", cmd_guess))
     app.add_handler(CommandHandler("players", cmd_players))
     app.add_handler(CommandHandler("leave", cmd_leave))
+    # в канал трансляцию включает его админ: /spectate <игра> <канал> в ЛС с ботом
+    app.add_handler(CommandHandler("spectate", cmd_spectate))
+    app.add_handler(CommandHandler("unspectate", cmd_unspectate))
 
     # общий роутер для callback'ов (ask/pass/vote_yes ...)
     app.add_handler(CallbackQueryHandler(callback_router))
 
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "bench-broadcast":
+        asyncio.run(bench_broadcast(int(sys.argv[2]) if len(sys.argv) > 2 else 10000))
+        return
+    if len(sys.argv) > 2 and sys.argv[1] == "replay":
+        # python code.py replay spyfall_events.log.2 spyfall_events.log.1 spyfall_events.log
+        asyncio.run(replay_event_log(sys.argv[2:]))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "resume":
+        # rolling deploy: kill -TERM <старый процесс> (или -USR1, чтобы игры доиграли); python code.py resume
+        wait_for_handover()
+
+    app = (
+        Application.builder().token(TOKEN)
+        .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+        .build()
+    )
+    register_handlers(app)
+
     print("Бот запущен...")
-    app.run_polling()
+    # SIGTERM/SIGUSR1 — передача состояния (см. on_startup), SIGINT — обычная остановка без передачи
+    app.run_polling(stop_signals=(signal.SIGINT,) if hasattr(signal, "SIGUSR1") else None)
 
 
 if __name__ == "__main__":